@@ -20,6 +20,40 @@ DATA_FILES = {
 START_DATE = datetime.date(2020, 1, 1)
 END_DATE = datetime.date(2021, 11, 1)
 
+# Whether the data should be stored sparsely (only the days with non-zero values are kept).
+# This saves memory for long time ranges at the cost of converting the data back when needed.
+SPARSE_SERIES = False
+
+# The file that a snapshot of the loaded data and cached results is saved to when the program
+# exits.  If it matches the current DATA_FILES, the next run starts from it instead of the files.
+SNAPSHOT_FILE = 'snapshot.bin'
+
+# The SQLite database that computed results are saved to, so that they persist between runs.
+RESULTS_DATABASE = 'results.sqlite3'
+
+# How the user interface is served: 'dev' uses Dash's development server (not suitable for
+# production), and 'waitress' uses the waitress WSGI server, handling requests in SERVER_THREADS
+# threads.
+SERVER_MODE = 'waitress'
+SERVER_THREADS = 4
+
+# The number of seconds between each check of DATA_FILES for changes.  A changed file is reloaded
+# without restarting the program.  Set this to 0 to disable checking.
+WATCH_INTERVAL = 5.0
+
+# Mapping of the resolutions the data can be analyzed at to the (approximate) number of days in
+# one of their periods, and to the name of their unit used for display purposes.
+RESOLUTION_DAYS = {
+    'daily': 1,
+    'weekly': 7,
+    'monthly': 30
+}
+RESOLUTION_UNITS = {
+    'daily': 'days',
+    'weekly': 'weeks',
+    'monthly': 'months'
+}
+
 # Sets of only the country codes or the stock codes.
 ALL_COUNTRIES = {
     'can',
@@ -7,10 +7,19 @@ being analyzed and coordinates the actual data manipulation.
 This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
 """
 import datetime
+import hashlib
+import threading
+from typing import Any, Optional, Union
 
-from parse_data import parse_covid_data_file, parse_stock_data_file
-from process_data import fill_covid_data, fill_stock_data, differentiate_stock_data, \
-    find_correlation_coefficient, find_matching_spikes
+import numpy as np
+
+from parse_data import parse_covid_data_file, parse_stock_data_file, hash_data_file, \
+    write_snapshot_file, read_snapshot_file
+from process_data import fill_covid_data, fill_stock_data, transform_stock_data, \
+    find_correlation_coefficient, find_shifted_correlation_coefficients, find_matching_spikes, \
+    find_period_starts, aggregate_data
+from results_store import ResultsStore
+from sparse_data import SparseSeries, make_sparse_from_dense, is_worth_storing_sparsely, to_dense
 
 
 class DataManager:
@@ -21,86 +30,117 @@ class DataManager:
     calculations are done in a separate module.
 
     Representation Invariants:
-        - len(self._stocks) == 4
-        - all(s in self._stocks for s in {'open', 'close', 'high', 'low'})
+        - set(self._stocks) == {'diff', 'percent', 'log', 'volatility'}
+        - all(set(self._stocks[t]) == {'open', 'close', 'high', 'low'} for t in self._stocks)
         - self._start < self._end
         - self._duration > 0
+        - set(self._periods) == {'weekly', 'monthly'}
+        - all(set(self._covid_aggregates[r]) == set(self._covid) for r in self._periods)
 
     >>> dm = DataManager({'data/stock-snp500.csv', 'data/covid-usa.csv'}, \
                          datetime.date(2021, 1, 1), datetime.date(2021, 1, 10))
     """
     # Private Instance Attributes:
     #     - _covid: A mapping from a country code the the new covid cases reported at that day.
-    #               The index in the list represents the number of days since _start.
-    #     - _stocks: A mapping from a stock stream (open/high/low/close), to a mapping from the
-    #                stock code to a list of the price change from yesterday.  By using a mapping
-    #                instead of a dataclass we can achieve a more dynamic behaviour avoiding a
-    #                large if statement block.
+    #               The index in the list represents the number of days since _start.  When
+    #               loaded from a snapshot, the lists are (read-only) arrays instead.
+    #     - _stocks: A mapping from a transform (diff/percent/log/volatility, see
+    #                transform_stock_data) to a mapping from a stock stream (open/high/low/close),
+    #                to a mapping from the stock code to an array of the price change from
+    #                yesterday, as measured by the transform.  By using a mapping instead of a
+    #                dataclass we can achieve a more dynamic behaviour avoiding a large if
+    #                statement block.  Every transform is calculated up front, so switching
+    #                between them costs nothing.
     #     - _start: The start date of the time period being analyzed.
     #     - _end: The end date of the time period being analyzed.  Note that this date is included
     #             in the time range.
     #     - _duration: The length (in days) of the period being analyzed.
-    _covid: dict[str, list[int]]
-    _stocks: dict[str, dict[str, list[float]]]
+    #     - _sparse: Whether the series in _covid and _stocks are stored as SparseSeries instead
+    #                of zero-filled lists, wherever that uses less memory.
+    #     - _periods: A mapping from a coarser resolution (weekly/monthly) to the offsets of the
+    #                 first day of each of its periods.
+    #     - _covid_aggregates: A mapping from a coarser resolution to a mapping in the same format
+    #                          as _covid, except that each index represents a whole period.
+    #     - _stock_aggregates: A mapping from a coarser resolution to a mapping in the same format
+    #                          as _stocks, except that each index represents a whole period.
+    #     - _sources: A mapping from a country or stock code to the file its data was loaded
+    #                 from.
+    #     - _hashes: A mapping from a country or stock code to the hash of the file its data was
+    #                loaded from.
+    #     - _results: The database results are read from and written to, or None if results
+    #                 should always be calculated.
+    #     - _lock: Held while the stored series are being swapped or read, so that a reload never
+    #              exposes a half-updated source.
+    _covid: dict[str, Union[list[int], np.ndarray, SparseSeries]]
+    _stocks: dict[str, dict[str, dict[str, Union[np.ndarray, SparseSeries]]]]
     _start: datetime.date
     _end: datetime.date
     _duration: int
-
-    def __init__(self, sources: set[str], start: datetime.date, end: datetime.date) -> None:
+    _sparse: bool
+    _periods: dict[str, list[int]]
+    _covid_aggregates: dict[str, dict[str, Union[list[int], np.ndarray]]]
+    _stock_aggregates: dict[str, dict[str, dict[str, dict[str, np.ndarray]]]]
+    _sources: dict[str, str]
+    _hashes: dict[str, str]
+    _results: Optional[ResultsStore]
+    _lock: threading.Lock
+
+    def __init__(self, sources: set[str], start: datetime.date, end: datetime.date,
+                 sparse: bool = False, results: Optional[ResultsStore] = None) -> None:
         """Load the data from the files in sources, only from start to end inclusive.
 
+        If sparse is True, the data is stored as SparseSeries, which only keep the days that
+        actually have a non-zero value.  This uses less memory for weekly reporting countries and
+        makes the spike detection in get_local_statistics skip over the padding.  A series with
+        too few zero days to save memory (such as most stock streams) is kept zero-filled.
+
+        If results is not None, the get_*_statistics methods first look for their result in
+        results, and save every result they calculate to it.
+
+        If sources is empty, no data is loaded (which is how load_snapshot starts).
+
         Preconditions:
-            - sources != set()
             - start < end
             - all('covid-' in s or 'stock-' in s for s in sources)
         """
         self._duration = (end - start).days + 1
 
         self._covid = {}
-        self._stocks = {
+        self._stocks = {transform: {
             'open': {},
             'high': {},
             'low': {},
             'close': {}
-        }
+        } for transform in ('diff', 'percent', 'log', 'volatility')}
         self._start = start
         self._end = end
+        self._sparse = sparse
+        self._sources = {}
+        self._hashes = {}
+        self._results = results
+        self._lock = threading.Lock()
+
+        self._periods = {resolution: find_period_starts(start, end, resolution)
+                         for resolution in ('weekly', 'monthly')}
+        self._covid_aggregates = {resolution: {} for resolution in self._periods}
+        self._stock_aggregates = {resolution: {transform: {stream: {} for stream in streams}
+                                               for transform, streams in self._stocks.items()}
+                                  for resolution in self._periods}
 
         for source in sources:
-            name = source[11:-4]
-
-            if 'covid-' in source:
-                dates, data = parse_covid_data_file(source, start, end)
-                self._covid[name] = fill_covid_data(dates, data, start, end)
-
-                # Invariants
-                assert len(self._covid[name]) == self._duration
-            else:
-                dates, *data = parse_stock_data_file(source, start - datetime.timedelta(days=1),
-                                                     end)
-
-                data = [differentiate_stock_data(x) for x in data]
-                dates.pop(0)  # the above implicitly chops off the first element
+            self._load_source(source)
 
-                data = [fill_stock_data(dates, x, start, end) for x in data]
-
-                self._stocks['open'][name] = data[0]
-                self._stocks['high'][name] = data[1]
-                self._stocks['low'][name] = data[2]
-                self._stocks['close'][name] = data[3]
-
-                # Invariants
-                assert len(self._stocks['open'][name]) == self._duration
-                assert len(self._stocks['high'][name]) == self._duration
-                assert len(self._stocks['low'][name]) == self._duration
-                assert len(self._stocks['close'][name]) == self._duration
-
-    def get_global_statistics(self, stock_stream: str, days: int, stock: str,
-                              country: str) -> list[float]:
+    def get_global_statistics(self, stock_stream: str, days: int, stock: str, country: str,
+                              resolution: str = 'daily', transform: str = 'diff') -> list[float]:
         """Calculate the correlation coefficient of stock_stream for the combination of stock and
         country over with a shift from 0 to days inclusive.  The index of the returned list is
         equal to the shift applied for that correlation coefficient.
 
+        If resolution is not 'daily', the statistics are calculated on the pre-aggregated weekly
+        or monthly data instead, in which case days is the maximum shift in weeks or months.
+        The transform decides how the stock price changes are measured (see
+        transform_stock_data).
+
         Logic:
             1. ASSUME that the reaction time of the stock market is constant.
             2. Therefore, if we shift the stock data back, the correlation coefficient will spike
@@ -109,8 +149,10 @@ class DataManager:
         Preconditions:
             - stock_stream in {'high', 'low', 'open', 'close'}
             - days > 0
-            - stock in self._stocks[stock_stream]
+            - stock in self._stocks[transform][stock_stream]
             - country in self._covid
+            - resolution in {'daily', 'weekly', 'monthly'}
+            - transform in {'diff', 'percent', 'log', 'volatility'}
 
         >>> import math
         >>> dm = DataManager({'data/stock-snp500.csv', 'data/covid-usa.csv'}, \
@@ -118,24 +160,40 @@ class DataManager:
         >>> c = dm.get_global_statistics('open', 10, 'snp500', 'usa')[0]
         >>> math.isclose(0.061052947594341433, c)
         True
+        >>> len(dm.get_global_statistics('open', 10, 'snp500', 'usa', 'monthly', 'percent'))
+        11
         """
-        initial_corr = find_correlation_coefficient(self._covid[country],
-                                                    self._stocks[stock_stream][stock])
-        data_so_far = [initial_corr]
-
-        for shift in range(1, days + 1):
-            stock_data = self._stocks[stock_stream][stock][shift:]
-            covid_data = self._covid[country][:-shift]
-            corr = find_correlation_coefficient(covid_data, stock_data)
-            data_so_far.append(corr)
+        with self._lock:
+            covid = self._get_covid(country, resolution)
+            stock_prices = self._get_stock(stock_stream, stock, resolution, transform)
+            data_hash = self._get_data_hash(country, stock)
+
+        if self._results is not None:
+            saved = self._results.get_results(country, stock, stock_stream, transform, 'global',
+                                              resolution, data_hash)
+            if all(shift in saved for shift in range(days + 1)):
+                return [saved[shift] for shift in range(days + 1)]
+
+        # Every shift is correlated in a single pass over the arrays, rather than one slice at a
+        # time.
+        data_so_far = find_shifted_correlation_coefficients(covid, stock_prices, days)
+
+        if self._results is not None:
+            self._results.add_results([(country, stock, stock_stream, transform, 'global', shift,
+                                        resolution, data_so_far[shift], data_hash)
+                                       for shift in range(days + 1)])
 
         return data_so_far
 
-    def get_local_statistics(self, stock_stream: str, stock: str, country: str,
-                             max_gap: int) -> float:
+    def get_local_statistics(self, stock_stream: str, stock: str, country: str, max_gap: int,
+                             resolution: str = 'daily', transform: str = 'diff') -> float:
         """Calculate the correlation correlation coefficient of stock_stream for the combination
         of stock and county assuming a reaction time of spikes at most max_gap days.
 
+        If resolution is not 'daily', the spikes are found in the pre-aggregated weekly or
+        monthly data instead, in which case max_gap is measured in weeks or months.  The
+        transform decides how the stock price changes are measured (see transform_stock_data).
+
         Logic:
             1. ASSUME that IF the stock reacts, it will react within max_dap days.
             2. ASSUME that the stock market only makes big jumps because of covid.
@@ -149,8 +207,10 @@ class DataManager:
         Preconditions:
             - stock_stream in {'high', 'low', 'open', 'close'}
             - country in self._covid
-            - stock in self._stocks[stock_stream]
+            - stock in self._stocks[transform][stock_stream]
             - max_gap >= 0
+            - resolution in {'daily', 'weekly', 'monthly'}
+            - transform in {'diff', 'percent', 'log', 'volatility'}
 
         >>> import math
         >>> dm = DataManager({'data/stock-snp500.csv', 'data/covid-usa.csv'}, \
@@ -159,15 +219,286 @@ class DataManager:
         >>> math.isclose(0.04975472647664612, c)
         True
         """
-        stock_spikes, covid_spikes = find_matching_spikes(self._stocks[stock_stream][stock],
-                                                          self._covid[country], max_gap)
-        return find_correlation_coefficient(covid_spikes, stock_spikes)
+        with self._lock:
+            stock_data = self._get_stock(stock_stream, stock, resolution, transform)
+            covid_data = self._get_covid(country, resolution)
+            data_hash = self._get_data_hash(country, stock)
+
+        if self._results is not None:
+            saved = self._results.get_results(country, stock, stock_stream, transform, 'local',
+                                              resolution, data_hash)
+            if max_gap in saved:
+                return saved[max_gap]
+
+        stock_spikes, covid_spikes = find_matching_spikes(stock_data, covid_data, max_gap)
+        corr = find_correlation_coefficient(covid_spikes, stock_spikes)
+
+        if self._results is not None:
+            self._results.add_results([(country, stock, stock_stream, transform, 'local', max_gap,
+                                        resolution, corr, data_hash)])
+
+        return corr
+
+    def find_peaks(self, method: str, min_value: float, min_parameter: int,
+                   max_parameter: int) -> list[tuple[str, str, str, str, str, int, float]]:
+        """Return the saved results of method that peak above min_value for a parameter between
+        min_parameter and max_parameter inclusive, as described by ResultsStore.find_peaks.
+
+        Only the results calculated from the currently loaded data are considered, so results
+        saved before a source was reloaded are never returned.
+
+        Preconditions:
+            - self._results is not None
+            - method in {'global', 'local'}
+        """
+        with self._lock:
+            stocks = self._stocks['diff']['open']
+            data_hashes = {self._get_data_hash(country, stock)
+                           for country in self._covid for stock in stocks}
+
+        return self._results.find_peaks(method, min_value, min_parameter, max_parameter,
+                                        data_hashes)
+
+    def reload_source(self, source: str) -> str:
+        """Reload the data from the file source, replacing the data currently loaded from it, and
+        return the country or stock code of source.
+
+        The new data is fully calculated before any of it is swapped in, so concurrent calls to
+        the get_*_statistics methods see either all the old data or all the new data of source.
+
+        Preconditions:
+            - 'covid-' in source or 'stock-' in source
+        """
+        return self._load_source(source)
+
+    def save_snapshot(self, path: str, caches: Optional[dict[str, Any]] = None) -> None:
+        """Save all the data of this data manager (at every resolution and transform), along with
+        caches, to the snapshot file at path.  caches can be any results worth keeping that can be
+        encoded as JSON, and is returned as is by load_snapshot.
+
+        Sparse data is saved in its dense form, so that it can be mapped directly from the file.
+        Any data mapped from a previous snapshot is first copied into memory, so that the snapshot
+        file can be replaced even if it is the one the data is mapped from (which Windows would
+        otherwise refuse).
+        """
+        with self._lock:
+            self._release_snapshot()
+
+            header = {
+                'start': self._start.isoformat(),
+                'end': self._end.isoformat(),
+                'sources': {self._sources[name]: self._hashes[name] for name in self._sources},
+                'caches': caches if caches is not None else {}
+            }
+
+            arrays = {}
+            for name, covid in self._covid.items():
+                arrays[f'covid/daily/{name}'] = np.asarray(to_dense(covid), dtype=np.int64)
+            for resolution, countries in self._covid_aggregates.items():
+                for name, covid in countries.items():
+                    arrays[f'covid/{resolution}/{name}'] = np.asarray(covid, dtype=np.int64)
+
+            for transform, streams in self._stocks.items():
+                for stream, stocks in streams.items():
+                    for name, stock in stocks.items():
+                        arrays[f'stocks/daily/{transform}/{stream}/{name}'] = \
+                            np.asarray(to_dense(stock), dtype=float)
+            for resolution, transforms in self._stock_aggregates.items():
+                for transform, streams in transforms.items():
+                    for stream, stocks in streams.items():
+                        for name, stock in stocks.items():
+                            arrays[f'stocks/{resolution}/{transform}/{stream}/{name}'] = \
+                                np.asarray(stock, dtype=float)
+
+        write_snapshot_file(path, header, arrays)
+
+    @staticmethod
+    def load_snapshot(path: str, sources: set[str], start: datetime.date, end: datetime.date,
+                      sparse: bool = False, results: Optional[ResultsStore] = None) \
+            -> tuple['DataManager', dict[str, Any]]:
+        """Return a data manager equivalent to DataManager(sources, start, end, sparse, results)
+        from the snapshot file at path, along with the caches saved with it.
+
+        The data is mapped from the file rather than read, so this is nearly instant regardless
+        of the amount of data.  sparse only applies to sources that are reloaded later, since the
+        snapshot holds dense data.
+
+        Raise a ValueError if the snapshot was not saved from a data manager over the same time
+        range and the current versions of the files in sources, and an OSError if the snapshot
+        (or one of the files in sources) cannot be read.
+
+        Preconditions:
+            - start < end
+            - all('covid-' in s or 'stock-' in s for s in sources)
+        """
+        header, arrays = read_snapshot_file(path)
+
+        if header['start'] != start.isoformat() or header['end'] != end.isoformat():
+            raise ValueError(f'{path} is a snapshot of a different time range')
+        elif set(header['sources']) != sources or \
+                any(hash_data_file(source) != header['sources'][source] for source in sources):
+            raise ValueError(f'{path} is a snapshot of different data files')
+
+        manager = DataManager(set(), start, end, sparse, results)
+
+        for source, file_hash in header['sources'].items():
+            manager._sources[source[11:-4]] = source
+            manager._hashes[source[11:-4]] = file_hash
+
+        for key, array in arrays.items():
+            kind, resolution, *rest = key.split('/')
+
+            if kind == 'covid' and resolution == 'daily':
+                manager._covid[rest[0]] = array
+            elif kind == 'covid':
+                manager._covid_aggregates[resolution][rest[0]] = array
+            elif resolution == 'daily':
+                manager._stocks[rest[0]][rest[1]][rest[2]] = array
+            else:
+                manager._stock_aggregates[resolution][rest[0]][rest[1]][rest[2]] = array
+
+        return (manager, header['caches'])
+
+    def _load_source(self, source: str) -> str:
+        """Load the data from the file source into this data manager, along with its weekly and
+        monthly aggregates, and return the country or stock code of source.
+
+        Preconditions:
+            - 'covid-' in source or 'stock-' in source
+        """
+        name = source[11:-4]
+        start, end = self._start, self._end
+        file_hash = hash_data_file(source)
+
+        if 'covid-' in source:
+            dates, data = parse_covid_data_file(source, start, end)
+            covid = fill_covid_data(dates, data, start, end)
+
+            if self._sparse and is_worth_storing_sparsely(covid):
+                covid = make_sparse_from_dense(covid)
+
+            # Invariants
+            assert len(covid) == self._duration
+
+            aggregates = {resolution: aggregate_data(covid, period_starts)
+                          for resolution, period_starts in self._periods.items()}
+
+            with self._lock:
+                self._sources[name] = source
+                self._hashes[name] = file_hash
+                self._covid[name] = covid
+                for resolution in aggregates:
+                    self._covid_aggregates[resolution][name] = aggregates[resolution]
+        else:
+            dates, *data = parse_stock_data_file(source, start - datetime.timedelta(days=1), end)
+
+            # Each row is a stock stream, in the order open, high, low, close.
+            prices = np.array(data, dtype=float)
+            dates.pop(0)  # transforming implicitly chops off the first element
+
+            stocks = {}
+            for transform in self._stocks:
+                changes = transform_stock_data(prices, transform)
+
+                rows = list(fill_stock_data(dates, changes, start, end))
+
+                if self._sparse:
+                    # Most days of a stock stream change, so a stream is only kept sparse when
+                    # that actually saves memory.
+                    rows = [make_sparse_from_dense(row) if is_worth_storing_sparsely(row) else row
+                            for row in rows]
+
+                stocks[transform] = {'open': rows[0], 'high': rows[1], 'low': rows[2],
+                                     'close': rows[3]}
+
+                # Invariants
+                assert all(len(rows[i]) == self._duration for i in range(4))
+
+            # Percent changes compound by multiplying, every other transform by adding.
+            aggregates = {}
+            for resolution, period_starts in self._periods.items():
+                aggregates[resolution] = {}
+                for transform in stocks:
+                    aggregates[resolution][transform] = {
+                        stream: aggregate_data(stocks[transform][stream], period_starts,
+                                               compound=(transform == 'percent'))
+                        for stream in stocks[transform]
+                    }
+
+            with self._lock:
+                self._sources[name] = source
+                self._hashes[name] = file_hash
+                for transform in stocks:
+                    for stream in stocks[transform]:
+                        self._stocks[transform][stream][name] = stocks[transform][stream]
+                        for resolution in aggregates:
+                            self._stock_aggregates[resolution][transform][stream][name] = \
+                                aggregates[resolution][transform][stream]
+
+        return name
+
+    def _release_snapshot(self) -> None:
+        """Replace every array mapped from a snapshot file by load_snapshot with an in-memory copy,
+        so that this data manager no longer keeps the file open.  The caller must be holding
+        self._lock.
+        """
+        mappings = [self._covid, *self._covid_aggregates.values()]
+        mappings.extend(stocks for streams in self._stocks.values()
+                        for stocks in streams.values())
+        mappings.extend(stocks for transforms in self._stock_aggregates.values()
+                        for streams in transforms.values() for stocks in streams.values())
+
+        for mapping in mappings:
+            for name, series in mapping.items():
+                if isinstance(series, np.memmap):
+                    mapping[name] = np.array(series)
+
+    def _get_data_hash(self, country: str, stock: str) -> str:
+        """Return a hash identifying the data that the statistics of the combination of country
+        and stock are calculated from.  The caller must be holding self._lock.
+
+        Preconditions:
+            - country in self._hashes
+            - stock in self._hashes
+        """
+        identity = f'{self._start}:{self._end}:{self._hashes[country]}:{self._hashes[stock]}'
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _get_covid(self, country: str, resolution: str) -> Union[list[int], SparseSeries]:
+        """Return the covid data of country at the given resolution.  The caller must be holding
+        self._lock.
+
+        Preconditions:
+            - country in self._covid
+            - resolution in {'daily', 'weekly', 'monthly'}
+        """
+        if resolution == 'daily':
+            return self._covid[country]
+        else:
+            return self._covid_aggregates[resolution][country]
+
+    def _get_stock(self, stock_stream: str, stock: str, resolution: str, transform: str) \
+            -> Union[np.ndarray, SparseSeries]:
+        """Return the stock_stream data of stock at the given resolution, transformed by
+        transform.  The caller must be holding self._lock.
+
+        Preconditions:
+            - stock_stream in {'high', 'low', 'open', 'close'}
+            - stock in self._stocks[transform][stock_stream]
+            - resolution in {'daily', 'weekly', 'monthly'}
+            - transform in {'diff', 'percent', 'log', 'volatility'}
+        """
+        if resolution == 'daily':
+            return self._stocks[transform][stock_stream][stock]
+        else:
+            return self._stock_aggregates[resolution][transform][stock_stream][stock]
 
 
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['datetime', 'parse_data', 'process_data'],
+        'extra-imports': ['datetime', 'hashlib', 'threading', 'numpy', 'parse_data', 'process_data',
+                          'results_store', 'sparse_data'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']
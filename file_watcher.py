@@ -0,0 +1,165 @@
+"""COVID-19 Economics - Data File Watcher
+
+This module consists of a single class, FileWatcher, which polls the data files
+in the background and notifies a callback whenever one of them is replaced.
+This allows the data to be refreshed without restarting the program.
+
+This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
+"""
+import threading
+from typing import Callable, Optional
+
+from parse_data import get_file_signature
+
+
+class FileWatcher:
+    """Watch a set of files for changes by periodically comparing their modification time and
+    size, calling a callback with the name of each file that changed.
+
+    Representation Invariants:
+        - self._interval > 0
+        - set(self._signatures) <= self._sources
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'covid-usa.csv')
+    >>> with open(path, 'w') as file:
+    ...     _ = file.write('date,new\\n')
+    >>> watcher = FileWatcher({path}, lambda source: print('reloaded'), 1.0)
+    >>> watcher.check()
+    set()
+    >>> with open(path, 'a') as file:
+    ...     _ = file.write('2021-01-01,1\\n')
+    >>> watcher.check() == {path}
+    reloaded
+    True
+    >>> watcher.check()
+    set()
+    """
+    # Private Instance Attributes:
+    #     - _sources: The files being watched.
+    #     - _callback: The function called with the name of a file when it changes.
+    #     - _interval: The number of seconds between each check for changes.
+    #     - _signatures: A mapping from a file to its (modification time, size) when it was last
+    #                    checked.  Files that could not be read are left out.
+    #     - _stop: Set when the background thread should stop.
+    #     - _thread: The background thread checking for changes, or None if it is not running.
+    _sources: set[str]
+    _callback: Callable[[str], None]
+    _interval: float
+    _signatures: dict[str, tuple[float, int]]
+    _stop: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, sources: set[str], callback: Callable[[str], None],
+                 interval: float) -> None:
+        """Initialize a watcher of the files in sources that calls callback when one of them
+        changes, checking every interval seconds.  The current state of the files is taken as
+        unchanged.
+
+        Preconditions:
+            - interval > 0
+        """
+        self._sources = sources
+        self._callback = callback
+        self._interval = interval
+        self._signatures = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        for source in sources:
+            signature = self._read_signature(source)
+            if signature is not None:
+                self._signatures[source] = signature
+
+    def start(self) -> None:
+        """Start checking for changes in a background thread.  The thread does not keep the
+        program alive once everything else has finished.
+
+        Preconditions:
+            - self._thread is None
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='file-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread started by start, waiting for it to finish.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self) -> set[str]:
+        """Check all the files once, calling the callback for (and returning) each of the files
+        that changed since the last check.
+
+        A file that cannot currently be read (for example because it is in the middle of being
+        replaced) is skipped, as is a file whose callback fails to parse it.  Either way the file
+        will be reported again by a later check.
+
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'covid-usa.csv')
+        >>> with open(path, 'w') as file:
+        ...     _ = file.write('date,new\\n')
+        >>> failures = [ValueError('half written')]
+        >>> def reload(source: str) -> None:
+        ...     if failures:
+        ...         raise failures.pop()
+        ...     print('reloaded')
+        >>> watcher = FileWatcher({path}, reload, 1.0)
+        >>> with open(path, 'a') as file:
+        ...     _ = file.write('2021-01-01,1\\n')
+        >>> watcher.check()  # the callback fails, so the file is not reported yet
+        set()
+        >>> watcher.check() == {path}
+        reloaded
+        True
+        """
+        changed_so_far = set()
+
+        for source in self._sources:
+            signature = self._read_signature(source)
+
+            if signature is None or signature == self._signatures.get(source):
+                continue
+
+            try:
+                self._callback(source)
+            except (OSError, ValueError, IndexError, StopIteration):
+                self._signatures.pop(source, None)
+            else:
+                self._signatures[source] = signature
+                changed_so_far.add(source)
+
+        return changed_so_far
+
+    def _run(self) -> None:
+        """Check the files every self._interval seconds until stop is called.
+        """
+        while not self._stop.wait(self._interval):
+            self.check()
+
+    def _read_signature(self, source: str) -> Optional[tuple[float, int]]:
+        """Return the signature of source, or None if it cannot be read.
+        """
+        try:
+            return get_file_signature(source)
+        except OSError:
+            return None
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['threading', 'parse_data'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
@@ -10,14 +10,47 @@ pointing your browser to localhost:8050.
 This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
 """
 from data_management import DataManager
+from file_watcher import FileWatcher
+from results_store import ResultsStore
 from user_interface import UserInterface
-from config import DATA_FILES, START_DATE, END_DATE
+from config import DATA_FILES, START_DATE, END_DATE, SPARSE_SERIES, WATCH_INTERVAL, \
+    RESULTS_DATABASE, SERVER_MODE, SERVER_THREADS, SNAPSHOT_FILE
+
 
 if __name__ == '__main__':
-    manager = DataManager(
-        sources=DATA_FILES,
-        start=START_DATE,
-        end=END_DATE
-    )
-    gui = UserInterface(manager)
-    gui.run()
+    results = ResultsStore(RESULTS_DATABASE)
+
+    try:
+        manager, caches = DataManager.load_snapshot(
+            path=SNAPSHOT_FILE,
+            sources=DATA_FILES,
+            start=START_DATE,
+            end=END_DATE,
+            sparse=SPARSE_SERIES,
+            results=results
+        )
+    except (OSError, ValueError):  # there is no usable snapshot, so start from the data files
+        manager = DataManager(
+            sources=DATA_FILES,
+            start=START_DATE,
+            end=END_DATE,
+            sparse=SPARSE_SERIES,
+            results=results
+        )
+        caches = None
+
+    gui = UserInterface(manager, caches)
+
+    watcher = None
+    if WATCH_INTERVAL > 0:
+        watcher = FileWatcher(DATA_FILES, gui.reload_source, WATCH_INTERVAL)
+        watcher.start()
+
+    try:
+        gui.run(mode=SERVER_MODE, threads=SERVER_THREADS)
+    finally:
+        # The watcher is stopped first (waiting for any reload to finish evicting the results it
+        # made stale), so that the snapshot never pairs new data with stale cached results.
+        if watcher is not None:
+            watcher.stop()
+        gui.save_snapshot(SNAPSHOT_FILE)
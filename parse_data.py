@@ -7,6 +7,22 @@ This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
 """
 import csv
 import datetime
+import hashlib
+import json
+import os
+import struct
+from typing import Any
+
+import numpy as np
+
+# The first bytes of every snapshot file, followed by the version of the snapshot layout.  The
+# version must be increased whenever the layout changes, so that old snapshots are rejected.
+SNAPSHOT_MAGIC = b'CVECSNAP'
+SNAPSHOT_VERSION = 1
+
+# Every array in a snapshot file starts at a multiple of this many bytes, so that the mapped
+# arrays are aligned.
+SNAPSHOT_ALIGNMENT = 64
 
 
 def parse_stock_data_file(filename: str, start: datetime.date, end: datetime.date) -> \
@@ -61,11 +77,122 @@ def parse_covid_data_file(filename: str, start: datetime.date, end: datetime.dat
         return (dates_so_far, cases_so_far)
 
 
+def get_file_signature(filename: str) -> tuple[float, int]:
+    """Return the last modification time and the size of the file filename, which together are
+    used to detect when a data file has been replaced.
+    """
+    stat = os.stat(filename)
+    return (stat.st_mtime, stat.st_size)
+
+
+def hash_data_file(filename: str) -> str:
+    """Return a hash of the contents of the file filename, used to detect results that were
+    calculated from a different version of the file.
+    """
+    with open(filename, mode='rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def align_snapshot_offset(offset: int) -> int:
+    """Return the smallest multiple of SNAPSHOT_ALIGNMENT that is at least offset.
+
+    >>> align_snapshot_offset(0), align_snapshot_offset(1), align_snapshot_offset(64)
+    (0, 64, 64)
+    """
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+def write_snapshot_file(filename: str, header: dict[str, Any],
+                        arrays: dict[str, np.ndarray]) -> None:
+    """Write header and arrays to the snapshot file filename, replacing it if it exists.
+
+    The file consists of SNAPSHOT_MAGIC, the version and the length of the header (as 32-bit
+    little-endian integers), header encoded as JSON, and then the raw bytes of every array.  The
+    layout of the arrays is stored in the header, so that they can be mapped directly from the
+    file by read_snapshot_file.  The file is written under a temporary name and then renamed, so
+    a reader never sees a partially written snapshot.
+
+    Preconditions:
+        - 'arrays' not in header
+        - header can be encoded as JSON
+    """
+    layout = {}
+    offset = 0
+
+    for key, array in arrays.items():
+        layout[key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += align_snapshot_offset(array.nbytes)
+
+    encoded_header = json.dumps({**header, 'arrays': layout}).encode()
+    prefix = SNAPSHOT_MAGIC + struct.pack('<II', SNAPSHOT_VERSION, len(encoded_header))
+    data_start = align_snapshot_offset(len(prefix) + len(encoded_header))
+
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, mode='wb') as file:
+        file.write(prefix + encoded_header)
+
+        for key, array in arrays.items():
+            file.seek(data_start + layout[key]['offset'])
+            file.write(np.ascontiguousarray(array).tobytes())
+
+        # Make sure the file covers the padding after the last array.
+        file.truncate(data_start + offset)
+
+    os.replace(temporary_filename, filename)
+
+
+def read_snapshot_file(filename: str) -> tuple[dict[str, Any], dict[str, np.ndarray]]:
+    """Return the header and the arrays of the snapshot file filename written by
+    write_snapshot_file.  The arrays are read-only views of the memory mapped file, so none of
+    their data is copied (or even read) until it is used.
+
+    Raise a ValueError if filename is not a snapshot file of the current version.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'snapshot')
+    >>> write_snapshot_file(filename, {'start': '2021-01-01'}, {'a': np.array([1.0, 2.0])})
+    >>> header, arrays = read_snapshot_file(filename)
+    >>> header['start'], arrays['a'].tolist()
+    ('2021-01-01', [1.0, 2.0])
+    """
+    with open(filename, mode='rb') as file:
+        prefix = file.read(len(SNAPSHOT_MAGIC) + 8)
+
+        if len(prefix) != len(SNAPSHOT_MAGIC) + 8 or not prefix.startswith(SNAPSHOT_MAGIC):
+            raise ValueError(f'{filename} is not a snapshot file')
+
+        version, header_length = struct.unpack('<II', prefix[len(SNAPSHOT_MAGIC):])
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'{filename} is a version {version} snapshot, '
+                             f'expected version {SNAPSHOT_VERSION}')
+
+        header = json.loads(file.read(header_length))
+
+    data_start = align_snapshot_offset(len(prefix) + header_length)
+    layout = header.pop('arrays')
+
+    if layout == {}:
+        return (header, {})
+
+    mapped = np.memmap(filename, dtype=np.uint8, mode='r')
+    arrays = {}
+
+    for key, array_layout in layout.items():
+        dtype = np.dtype(array_layout['dtype'])
+        start = data_start + array_layout['offset']
+        count = int(np.prod(array_layout['shape']))
+        arrays[key] = mapped[start:start + count * dtype.itemsize].view(dtype) \
+            .reshape(array_layout['shape'])
+
+    return (header, arrays)
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['csv', 'datetime'],
-        'allowed-io': ['parse_stock_data_file', 'parse_covid_data_file'],
+        'extra-imports': ['csv', 'datetime', 'hashlib', 'json', 'os', 'struct', 'numpy'],
+        'allowed-io': ['parse_stock_data_file', 'parse_covid_data_file', 'get_file_signature',
+                       'hash_data_file', 'write_snapshot_file', 'read_snapshot_file'],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']
     })
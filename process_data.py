@@ -1,58 +1,98 @@
 """COVID-19 Economics - Data Processing
 
 This module consists of helper functions that perform the data manipulations
-and call into the pandas module.
+and call into the numpy module.
 
 This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
 """
 import datetime
 from typing import Union
 
-import pandas as pd
+import numpy as np
 
+from sparse_data import SparseSeries, to_dense
 
-def differentiate_stock_data(data: list[float]) -> list[float]:
-    """Convert the prices in the stock data from absolute (cost) to relative
-    (change in cost from yesterday).
 
-    Convert the prices in the stock data from absolute (cost) to relative
-    (change in cost from yesterday).
+def transform_stock_data(prices: np.ndarray, transform: str, window: int = 20) -> np.ndarray:
+    """Convert the prices in the stock data from absolute (cost) to relative (change from
+    yesterday), where each row of prices is a separate stock stream.  The returned array has one
+    fewer column than prices, since the first day has no yesterday.
 
-    Preconditions:
-        - len(data) >= 2
+    The transform decides how the change from yesterday is measured:
+        - 'diff': the change in cost.
+        - 'percent': the change in cost as a fraction of yesterday's cost.
+        - 'log': the log of the ratio of today's cost to yesterday's cost.
+        - 'volatility': the 'percent' change divided by the standard deviation of the 'percent'
+                        changes over the previous window days (or 0.0 if there are fewer than two
+                        previous days, or they are all the same).
 
-    >>> import math
-    >>> expected = [-1.0]
-    >>> actual = differentiate_stock_data([1.0, 0.0])
-    >>> all(math.isclose(actual[i], expected[i]) for i in range(len(expected)))
+    Since every transform is a whole-array operation, all the stock streams are converted at once.
+
+    Preconditions:
+        - prices.ndim == 2 and prices.shape[1] >= 2
+        - transform in {'diff', 'percent', 'log', 'volatility'}
+        - transform == 'diff' or (prices > 0).all()
+        - window >= 2
+
+    >>> prices = np.array([[1.0, 2.0, 1.0], [4.0, 2.0, 3.0]])
+    >>> transform_stock_data(prices, 'diff').tolist()
+    [[1.0, -1.0], [-2.0, 1.0]]
+    >>> transform_stock_data(prices, 'percent').tolist()
+    [[1.0, -0.5], [-0.5, 0.5]]
+    >>> np.allclose(transform_stock_data(prices, 'log'), np.log([[2.0, 0.5], [0.5, 1.5]]))
     True
+    >>> np.round(transform_stock_data(np.array([[1.0, 2.0, 1.0, 2.0]]), 'volatility'), 4).tolist()
+    [[0.0, 0.0, 0.9428]]
     """
-    relative_so_far = []
+    if transform == 'diff':
+        return np.diff(prices, axis=1)
+    elif transform == 'log':
+        return np.diff(np.log(prices), axis=1)
 
-    for i in range(1, len(data)):
-        yesterday = data[i - 1]
-        today = data[i]
-        relative_so_far.append(today - yesterday)
+    returns = np.diff(prices, axis=1) / prices[:, :-1]
 
-    return relative_so_far
+    if transform == 'percent':
+        return returns
 
+    # The trailing sums (and sums of squares) are found from cumulative sums, so that the
+    # standard deviation of every window is calculated without a python loop.
+    zeros = np.zeros((returns.shape[0], 1))
+    sums = np.concatenate((zeros, np.cumsum(returns, axis=1)), axis=1)
+    squares = np.concatenate((zeros, np.cumsum(returns ** 2, axis=1)), axis=1)
 
-def fill_stock_data(dates: list[datetime.date], data: list[float], start: datetime.date,
-                    end: datetime.date) -> list[float]:
-    """Fill the given data such that the returned list is equal to the number of days between start
-    and end inclusive.  Dates that are not provided in data are assumed to be 0.0 (does not change
-    over the weekend).
+    ends = np.arange(returns.shape[1])
+    starts = np.maximum(ends - window, 0)
+    counts = ends - starts
+
+    window_sums = sums[:, ends] - sums[:, starts]
+    window_squares = squares[:, ends] - squares[:, starts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variances = (window_squares - window_sums ** 2 / counts) / (counts - 1)
+        deviations = np.sqrt(np.maximum(variances, 0.0))
+        normalized = returns / deviations
+
+    return np.where((counts >= 2) & (deviations > 0.0), normalized, 0.0)
+
+
+def fill_stock_data(dates: list[datetime.date], data: np.ndarray, start: datetime.date,
+                    end: datetime.date) -> np.ndarray:
+    """Fill the given data such that each row of the returned array is equal to the number of
+    days between start and end inclusive, where each row of data is a separate stock stream.
+    Dates that are not provided in data are assumed to be 0.0 (does not change over the weekend).
 
     Preconditions:
-        - len(data) == len(dates)
+        - data.ndim == 2 and data.shape[1] == len(dates)
         - start < end
+        - all(start <= d <= end for d in dates)
 
     >>> fill_stock_data([datetime.date(2021, 1, 2), datetime.date(2021, 1, 4)], \
-                        [1.0, 2.0], datetime.date(2021, 1, 1), datetime.date(2021, 1, 4))
-    [0.0, 1.0, 0.0, 2.0]
+                        np.array([[1.0, 2.0]]), datetime.date(2021, 1, 1), \
+                        datetime.date(2021, 1, 4)).tolist()
+    [[0.0, 1.0, 0.0, 2.0]]
     """
-    filled_data = [0.0] * ((end - start).days + 1)
-    fill_data(dates, data, filled_data, start)
+    filled_data = np.zeros((data.shape[0], (end - start).days + 1))
+    offsets = [(date - start).days for date in dates]
+    filled_data[:, offsets] = data
     return filled_data
 
 
@@ -77,8 +117,7 @@ def fill_covid_data(dates: list[datetime.date], data: list[int], start: datetime
 
 def fill_data(dates: list[datetime.date], data: list[Union[int, float]],
               base: list[Union[int, float]], start: datetime.date) -> None:
-    """Backend function for fill_covid_data and fill_stock_data.  Actually performs the copy in a
-    type agnostic way.
+    """Backend function for fill_covid_data.  Actually performs the copy in a type agnostic way.
 
     Preconditions:
         - len(data) == len(dates)
@@ -97,36 +136,164 @@ def fill_data(dates: list[datetime.date], data: list[Union[int, float]],
         base[actual_index] = data[i]
 
 
-def inflated_abs_average(data: list[Union[int, float]]) -> float:
+def find_period_starts(start: datetime.date, end: datetime.date, resolution: str) -> list[int]:
+    """Return the offsets (in days since start) of the first day of each period between start
+    and end inclusive.  A weekly period starts on a Monday and a monthly period starts on the
+    first of the month, except for the first period which always starts at start.
+
+    Preconditions:
+        - start < end
+        - resolution in {'daily', 'weekly', 'monthly'}
+
+    >>> find_period_starts(datetime.date(2021, 1, 1), datetime.date(2021, 1, 4), 'daily')
+    [0, 1, 2, 3]
+    >>> find_period_starts(datetime.date(2021, 1, 1), datetime.date(2021, 1, 20), 'weekly')
+    [0, 3, 10, 17]
+    >>> find_period_starts(datetime.date(2021, 1, 15), datetime.date(2021, 3, 1), 'monthly')
+    [0, 17, 45]
+    """
+    duration = (end - start).days + 1
+
+    if resolution == 'daily':
+        return list(range(duration))
+    elif resolution == 'weekly':
+        first_monday = (7 - start.weekday()) % 7
+        return [0] + [d for d in range(first_monday, duration, 7) if d != 0]
+    else:
+        starts_so_far = [0]
+        year, month = start.year, start.month
+
+        while True:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            offset = (datetime.date(year, month, 1) - start).days
+
+            if offset >= duration:
+                return starts_so_far
+
+            starts_so_far.append(offset)
+
+
+def aggregate_data(data: Union[list[Union[int, float]], np.ndarray, SparseSeries],
+                   period_starts: list[int], compound: bool = False) \
+        -> Union[list[Union[int, float]], np.ndarray]:
+    """Return the total of data over each period, where period_starts are the indices of the first
+    day of each period (as returned by find_period_starts).
+
+    By default the total is the sum, which for covid data is the number of new cases in each
+    period, and for stock data transformed by 'diff' or 'log' is the total change over each
+    period, since those daily changes compound by adding up.  If compound is True the daily
+    changes are instead fractions of yesterday's cost (the 'percent' transform), which compound
+    by multiplying (1 + change).  A SparseSeries is aggregated without making it dense, and both
+    a SparseSeries and an array are aggregated into an array.
+
+    Preconditions:
+        - period_starts != [] and period_starts[0] == 0
+        - all(period_starts[i] < period_starts[i + 1] for i in range(len(period_starts) - 1))
+        - period_starts[-1] < len(data)
+
+    >>> aggregate_data([1, 2, 3, 4, 5], [0, 2, 4])
+    [3, 7, 5]
+    >>> aggregate_data(SparseSeries([1, 3], [2.0, 4.0], 5), [0, 2, 4]).tolist()
+    [2.0, 4.0, 0.0]
+    >>> aggregate_data(np.array([0.5, 1.0, 0.0]), [0, 2], compound=True).tolist()
+    [2.0, 0.0]
+    >>> aggregate_data(SparseSeries([0, 1], [0.5, 1.0], 3), [0, 2], compound=True).tolist()
+    [2.0, 0.0]
+    """
+    if isinstance(data, SparseSeries):
+        # The period of each stored day, since period_starts[0] == 0 every day has one.
+        periods = np.searchsorted(period_starts, data.offsets, side='right') - 1
+
+        if compound:
+            factors = np.ones(len(period_starts))
+            np.multiply.at(factors, periods, 1.0 + data.values)
+            return factors - 1.0
+        else:
+            totals = np.bincount(periods, weights=data.values, minlength=len(period_starts))
+            return totals.astype(data.values.dtype)
+    elif isinstance(data, np.ndarray):
+        if compound:
+            return np.multiply.reduceat(1.0 + data, period_starts) - 1.0
+        else:
+            return np.add.reduceat(data, period_starts)
+
+    bounds = period_starts + [len(data)]
+
+    if compound:
+        return [float(np.prod([1.0 + x for x in data[bounds[i]:bounds[i + 1]]])) - 1.0
+                for i in range(len(period_starts))]
+    else:
+        return [sum(data[bounds[i]:bounds[i + 1]]) for i in range(len(period_starts))]
+
+
+def inflated_abs_average(data: Union[list[Union[int, float]], np.ndarray, SparseSeries]) \
+        -> float:
     """Find the average of the magnitude of the lements of data, dropping all 0 values.
 
     We drop all 0 values under the assumption that they were added by fill_*_data at some point
-    in the past (which is true with the dataset and time range).
+    in the past (which is true with the dataset and time range).  A SparseSeries never stores its
+    0 values, so it is averaged directly without scanning the padding.
 
     Preconditions:
-        - data != []
-        - any(x != 0 for x in data)
+        - len(data) > 0
+        - isinstance(data, SparseSeries) or any(x != 0 for x in data)
+        - not isinstance(data, SparseSeries) or len(data.values) > 0
 
     >>> inflated_abs_average([0, 0, 0, 0, 0, 0, 1, -1])
     1.0
     >>> inflated_abs_average([0, 0, -10.0, 0])
     10.0
+    >>> inflated_abs_average(SparseSeries([2], [-10.0], 4))
+    10.0
     """
+    if isinstance(data, SparseSeries):
+        return data.abs_average()
+    elif isinstance(data, np.ndarray):
+        return float(np.abs(data[data != 0]).mean())
+
     inflated_data = [abs(x) for x in data if x != 0]
     return sum(inflated_data) / len(inflated_data)
 
 
-def find_matching_spikes(stock: list[float], covid: list[int], max_gap: int) \
+def find_spikes(data: Union[list[Union[int, float]], np.ndarray, SparseSeries],
+                threshold: float) -> list[tuple[int, Union[int, float]]]:
+    """Return the (index, value) pairs of the elements of data whose magnitude is at least
+    threshold, in increasing order of index.
+
+    Preconditions:
+        - threshold > 0
+
+    >>> find_spikes([1.0, 0.5, 0.0, -1.0], 1.0)
+    [(0, 1.0), (3, -1.0)]
+    >>> find_spikes(SparseSeries([0, 1, 3], [1.0, 0.5, -1.0], 4), 1.0)
+    [(0, 1.0), (3, -1.0)]
+    >>> find_spikes(np.array([1.0, 0.5, 0.0, -1.0]), 1.0)
+    [(0, 1.0), (3, -1.0)]
+    """
+    if isinstance(data, SparseSeries):
+        return data.spikes(threshold)
+    elif isinstance(data, np.ndarray):
+        indices = np.flatnonzero(np.abs(data) >= threshold)
+        return list(zip(indices.tolist(), data[indices].tolist()))
+
+    return [(i, data[i]) for i in range(len(data)) if abs(data[i]) >= threshold]
+
+
+def find_matching_spikes(stock: Union[list[float], np.ndarray, SparseSeries],
+                         covid: Union[list[int], SparseSeries], max_gap: int) \
         -> tuple[list[float], list[int]]:
     """Matching the day of the first time covid broke the threshold with the first day of
     the first stock spike. Will return list with the covid spike indices lined up with the
     correlating stock spike indices.
 
+    Either of stock and covid may be a SparseSeries, in which case only the stored days are
+    searched for spikes, and stock may also be an array.
+
     Preconditions:
         - len(stock) == len(covid)
         - max_gap >= 0
-        - stock != []
-        - covid != []
+        - len(stock) > 0
+        - len(covid) > 0
 
     >>> stock = [1.0, 1.0, 0.0, 1.0, 0.0]
     >>> covid = [  1,   0,   1,   0,   0]
@@ -140,109 +307,162 @@ def find_matching_spikes(stock: list[float], covid: list[int], max_gap: int) \
     >>> covid = [  1,   0,   1,   0,   0]
     >>> find_matching_spikes(stock, covid, 2)
     ([1.0, 1.0, 0.0], [1, 0, 1])
+    >>> from sparse_data import make_sparse_from_dense
+    >>> find_matching_spikes(make_sparse_from_dense(stock), make_sparse_from_dense(covid), 2)
+    ([1.0, 1.0, 0.0], [1, 0, 1])
     """
-    stock_threshold = inflated_abs_average(stock)
-    covid_threshold = inflated_abs_average(covid)
+    # Since both thresholds are positive, 0 values are never spikes, so only the spikes
+    # themselves need to be walked when matching them up.
+    stock_spikes = find_spikes(stock, inflated_abs_average(stock))
+    covid_spikes = find_spikes(covid, inflated_abs_average(covid))
 
     stock_spikes_so_far = []
     covid_spikes_so_far = []
 
     stock_index = 0
     covid_index = 0
-    while stock_index < len(stock) or covid_index < len(covid):
-        # Search linearly through stock until we find a spike.
-        # When this loop ends the value at stock_index will be that spike.
-        while stock_index < len(stock) and abs(stock[stock_index]) < stock_threshold:
-            stock_index += 1
-
-        # Search linearly through covid until we find a spike.
-        # When this loop ends the value at stock_index will be that spike.
-        while covid_index < len(covid) and abs(covid[covid_index]) < covid_threshold:
-            covid_index += 1
-
-        # Edge case: if we reach the end of both lists, don't consider the indices.
-        if stock_index >= len(stock) and covid_index >= len(covid):
-            break
-
+    while stock_index < len(stock_spikes) or covid_index < len(covid_spikes):
         # When one of the indices has reached the end, but the other is still valid, we match the
         # valid one with 0 or 0.0.
-        elif stock_index >= len(stock):
+        if stock_index >= len(stock_spikes):
             stock_spikes_so_far.append(0.0)
-            covid_spikes_so_far.append(covid[covid_index])
+            covid_spikes_so_far.append(covid_spikes[covid_index][1])
             covid_index += 1
-        elif covid_index >= len(covid):
-            stock_spikes_so_far.append(stock[stock_index])
+        elif covid_index >= len(covid_spikes):
+            stock_spikes_so_far.append(stock_spikes[stock_index][1])
             covid_spikes_so_far.append(0)
             stock_index += 1
 
-        # When both indices are in valid, and covid_index is no more than max_gap before
-        # stock_index, we can match the points together.
-        elif 0 <= stock_index - covid_index <= max_gap:
-            stock_spikes_so_far.append(stock[stock_index])
-            covid_spikes_so_far.append(covid[covid_index])
+        # When both indices are in valid, and the covid spike is no more than max_gap days before
+        # the stock spike, we can match the points together.
+        elif 0 <= stock_spikes[stock_index][0] - covid_spikes[covid_index][0] <= max_gap:
+            stock_spikes_so_far.append(stock_spikes[stock_index][1])
+            covid_spikes_so_far.append(covid_spikes[covid_index][1])
             covid_index += 1
             stock_index += 1
 
         # When both indices are in range, but have an invalid gap, we can match the one farther
         # behind with 0 or 0.0.
-        elif covid_index < stock_index:
+        elif covid_spikes[covid_index][0] < stock_spikes[stock_index][0]:
             stock_spikes_so_far.append(0.0)
-            covid_spikes_so_far.append(covid[covid_index])
+            covid_spikes_so_far.append(covid_spikes[covid_index][1])
             covid_index += 1
         else:
-            stock_spikes_so_far.append(stock[stock_index])
+            stock_spikes_so_far.append(stock_spikes[stock_index][1])
             covid_spikes_so_far.append(0)
             stock_index += 1
 
     return (stock_spikes_so_far, covid_spikes_so_far)
 
 
-def convert_to_lengthwise(covid: list[float], stock: list[float]) -> list[tuple]:
-    """Converts spike data into form that will be accepted by the Panda's library DataFrame class.
-
-    Preconditions:
-        - len(covid) == len(stock)
-
-    >>> convert_to_lengthwise([0.2 , 0.0, 0.6, 0.2], [0.3, 0.6, 0.0, 0.1])
-    [(0.2, 0.3), (0.0, 0.6), (0.6, 0.0), (0.2, 0.1)]
-    """
-    final_data = []
-    for i in range(len(covid)):
-        final_data.append((covid[i], stock[i]))
-    return final_data
-
-
-def find_correlation_coefficient(covid: list[float], stock: list[float]) -> float:
+def find_correlation_coefficient(covid: Union[list[float], SparseSeries, np.ndarray],
+                                 stock: Union[list[float], SparseSeries, np.ndarray]) -> float:
     """Returns correlation coefficient of covid against stock, assuming that that equal indices
-    imply equal dates.
+    imply equal dates.  A SparseSeries is converted to its dense version first.
 
     Preconditions
         - len(covid) == len(stock)
-        - len(convert_data(covid, stock)) > 2
 
     >>> import math
     >>> c = find_correlation_coefficient([0.2 , 0.0, 0.6, 0.2], [0.3, 0.6, 0.0, 0.1])
     >>> math.isclose(-0.8510644963469901, c)
     True
+    >>> find_correlation_coefficient([1, 1, 1], [0.3, 0.6, 0.0])
+    0.0
     """
-    data = convert_to_lengthwise(covid, stock)
-    df = pd.DataFrame(data, columns=['covid', 'stocks'])
-    correlation = df.corr()
+    covid_deviations = np.asarray(to_dense(covid), dtype=float)
+    stock_deviations = np.asarray(to_dense(stock), dtype=float)
 
     # If there is not enough data to calculate a correlation coefficient, for our purposes it
     # suffices that we can say there is 0 correlation.  This avoids complexity in the caller.
-    if correlation.empty or correlation['covid']['stocks'] >= 1.0 or \
-            pd.isna(correlation['covid']['stocks']):
+    if len(covid_deviations) < 2:
+        return 0.0
+
+    covid_deviations = covid_deviations - covid_deviations.mean()
+    stock_deviations = stock_deviations - stock_deviations.mean()
+    scale = np.sqrt(np.dot(covid_deviations, covid_deviations)
+                    * np.dot(stock_deviations, stock_deviations))
+
+    if scale == 0.0:
+        return 0.0
+
+    correlation = float(np.dot(covid_deviations, stock_deviations) / scale)
+
+    if correlation >= 1.0:
         return 0.0
     else:
-        return correlation['covid']['stocks']
+        return correlation
+
+
+def find_shifted_correlation_coefficients(covid: Union[list[float], SparseSeries, np.ndarray],
+                                          stock: Union[list[float], SparseSeries, np.ndarray],
+                                          max_shift: int) -> list[float]:
+    """Return the correlation coefficient of covid against stock shifted back by each number of
+    days from 0 to max_shift inclusive.  Element shift of the returned list is equal to
+    find_correlation_coefficient(covid[:len(covid) - shift], stock[shift:]).
+
+    Rather than correlating every shifted pair of slices separately, the sums needed by every
+    shift are found at once: the cross products from a single np.correlate, and the sums (and
+    sums of squares) of each slice from cumulative sums.
+
+    Preconditions
+        - len(covid) == len(stock)
+        - len(covid) > 0
+        - max_shift >= 0
+
+    >>> import math
+    >>> covid, stock = [0.2, 0.0, 0.6, 0.2, 0.5], [0.3, 0.6, 0.0, 0.1, 0.4]
+    >>> cs = find_shifted_correlation_coefficients(covid, stock, 4)
+    >>> all(math.isclose(cs[shift], find_correlation_coefficient(covid[:5 - shift], \
+                                                                 stock[shift:]), abs_tol=1e-12) \
+            for shift in range(5))
+    True
+    >>> find_shifted_correlation_coefficients([1, 1, 1], [0.3, 0.6, 0.0], 1)
+    [0.0, 0.0]
+    """
+    covid = np.asarray(to_dense(covid), dtype=float)
+    stock = np.asarray(to_dense(stock), dtype=float)
+    length = len(covid)
+
+    # Centering both series first keeps the sums small, so that little precision is lost when
+    # the deviations of each slice are found by subtracting them.
+    covid = covid - covid.mean()
+    stock = stock - stock.mean()
+
+    shifts = np.arange(max_shift + 1)
+    counts = np.maximum(length - shifts, 0)
+    lags = np.minimum(shifts, length - 1)
+
+    # cross[shift] is the dot product of covid[:length - shift] and stock[shift:].
+    cross = np.correlate(stock, covid, mode='full')[length - 1:][lags]
+
+    zero = np.zeros(1)
+    covid_sums = np.concatenate((zero, np.cumsum(covid)))[counts]
+    covid_squares = np.concatenate((zero, np.cumsum(covid ** 2)))[counts]
+    stock_sums = np.concatenate((zero, np.cumsum(stock[::-1])))[counts]
+    stock_squares = np.concatenate((zero, np.cumsum(stock[::-1] ** 2)))[counts]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariances = cross - covid_sums * stock_sums / counts
+        covid_variances = covid_squares - covid_sums ** 2 / counts
+        stock_variances = stock_squares - stock_sums ** 2 / counts
+        correlations = covariances / np.sqrt(covid_variances * stock_variances)
+
+    # As in find_correlation_coefficient, a shift without enough data (or without any variation
+    # in either slice, or with perfect correlation) has 0 correlation.  Since the subtractions
+    # above leave rounding error behind, these are recognized within a small tolerance.
+    tolerance = 1e-12
+    is_defined = (counts >= 2) & (covid_variances > tolerance * covid_squares) \
+        & (stock_variances > tolerance * stock_squares) & (correlations < 1.0 - tolerance)
+
+    return np.where(is_defined, correlations, 0.0).tolist()
 
 
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'extra-imports': ['datetime', 'pandas'],
+        'extra-imports': ['datetime', 'numpy', 'sparse_data'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']
@@ -0,0 +1,124 @@
+"""COVID-19 Economics - Result Cache
+
+This module consists of a single class, ResultCache, which is a thread-safe
+cache of calculated results.  When several threads request the same missing
+result at once, it is only calculated once and every thread waits for that
+single calculation.
+
+This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class ResultCache:
+    """A thread-safe mapping from a unique id of a result to the result itself, which merges
+    concurrent calculations of the same result.
+
+    Representation Invariants:
+        - all(key not in self._results for key in self._pending)
+
+    >>> cache = ResultCache()
+    >>> cache.get('usa-snp500', lambda: 1.0)
+    1.0
+    >>> cache.get('usa-snp500', lambda: 2.0)  # already cached, so not recalculated
+    1.0
+    >>> cache.evict(lambda key: 'usa' in key.split('-'))
+    >>> cache.get('usa-snp500', lambda: 2.0)
+    2.0
+    """
+    # Private Instance Attributes:
+    #     - _results: A mapping from the id of a result to the result, for the results that have
+    #                 finished being calculated.
+    #     - _pending: A mapping from the id of a result to the future result, for the results
+    #                 that are currently being calculated.
+    #     - _lock: Held while accessing any of the above attributes.
+    _results: dict[str, Any]
+    _pending: dict[str, Future]
+    _lock: threading.Lock
+
+    def __init__(self, results: Optional[dict[str, Any]] = None) -> None:
+        """Initialize a cache holding results (a mapping from the id of a result to the result),
+        or an empty cache if results is None.
+        """
+        self._results = dict(results) if results is not None else {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, calculate: Callable[[], Any]) -> Any:
+        """Return the result with id key, calling calculate to find it if it is not cached.
+
+        If another thread is already calculating the result with id key, wait for it to finish
+        and return its result instead of calling calculate.  If calculate raises an error, the
+        error is raised in every thread waiting for the result, and nothing is cached.
+        """
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+            elif key in self._pending:
+                future = self._pending[key]
+                is_owner = False
+            else:
+                future = Future()
+                self._pending[key] = future
+                is_owner = True
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = calculate()
+        except BaseException as error:
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+            future.set_exception(error)
+            raise
+
+        # If the result was evicted while it was being calculated, it may have been calculated
+        # from outdated data, so it is only returned to the threads already waiting for it.
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+                self._results[key] = result
+
+        future.set_result(result)
+        return result
+
+    def get_results(self) -> dict[str, Any]:
+        """Return a mapping from the id of every cached result to the result.  Results that are
+        still being calculated are not included.
+
+        >>> cache = ResultCache({'usa-snp500': 1.0})
+        >>> cache.get_results()
+        {'usa-snp500': 1.0}
+        """
+        with self._lock:
+            return dict(self._results)
+
+    def evict(self, should_evict: Callable[[str], bool]) -> None:
+        """Remove every result whose id satisfies should_evict.  Calculations of such results
+        that are currently in progress still finish, but their results are not cached.
+        """
+        with self._lock:
+            self._results = {key: result for key, result in self._results.items()
+                             if not should_evict(key)}
+            self._pending = {key: future for key, future in self._pending.items()
+                             if not should_evict(key)}
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['threading', 'concurrent.futures'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
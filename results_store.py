@@ -0,0 +1,174 @@
+"""COVID-19 Economics - Results Database
+
+This module consists of a single class, ResultsStore, which persists the
+computed correlation coefficients in an SQLite database.  This keeps the
+results across restarts, and allows them to be queried outside of the user
+interface.
+
+This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
+"""
+import os
+import sqlite3
+import threading
+
+# The version of the layout of the results table.  This must be increased whenever the layout
+# changes, so that databases with the old layout are recreated.
+SCHEMA_VERSION = 1
+
+
+class ResultsStore:
+    """An SQLite database of computed correlation coefficients.
+
+    Each result is identified by the combination of country, stock, stock stream, transform of
+    the stock data, method ('global' or 'local'), parameter (the shift for global results, and
+    the maximum gap for local results) and resolution (the window each data point covers).
+    Every result is also stamped with a hash of the data it was calculated from, so that results
+    calculated from data that has since changed are never returned.
+
+    Representation Invariants:
+        - self._connection is not None
+
+    >>> store = ResultsStore(':memory:')
+    >>> store.add_results([('usa', 'snp500', 'open', 'diff', 'global', 0, 'daily', 0.1, 'abc'), \
+                           ('usa', 'snp500', 'open', 'diff', 'global', 1, 'daily', 0.4, 'abc')])
+    >>> store.get_results('usa', 'snp500', 'open', 'diff', 'global', 'daily', 'abc')
+    {0: 0.1, 1: 0.4}
+    >>> store.get_results('usa', 'snp500', 'open', 'diff', 'global', 'daily', 'stale')
+    {}
+    >>> store.find_peaks('global', 0.3, 0, 5, {'abc'})
+    [('usa', 'snp500', 'open', 'diff', 'daily', 1, 0.4)]
+    >>> store.find_peaks('global', 0.3, 0, 5, {'stale'})
+    []
+    """
+    # Private Instance Attributes:
+    #     - _path: The path of the database.
+    #     - _connection: The connection to the database.
+    #     - _pid: The id of the process that opened _connection.  An SQLite connection must not
+    #             be used by a forked child process, so the child opens its own connection.
+    #     - _lock: Held while using _connection, so that the store can be shared between threads.
+    _path: str
+    _connection: sqlite3.Connection
+    _pid: int
+    _lock: threading.Lock
+
+    def __init__(self, path: str) -> None:
+        """Open (or create) the results database at path.  If path is ':memory:' the database
+        only lasts as long as this object.
+        """
+        self._path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+        with self._lock, self._connection:
+            # The results are only a cache, so a database with an older layout is simply
+            # recreated rather than migrated.
+            version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                self._connection.execute('DROP TABLE IF EXISTS results')
+                self._connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    country TEXT NOT NULL,
+                    stock TEXT NOT NULL,
+                    stream TEXT NOT NULL,
+                    transform TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    parameter INTEGER NOT NULL,
+                    resolution TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    data_hash TEXT NOT NULL,
+                    PRIMARY KEY (country, stock, stream, transform, method, parameter, resolution)
+                )''')
+
+            # Used by find_peaks, which searches every combination at once.
+            self._connection.execute('''
+                CREATE INDEX IF NOT EXISTS results_by_method
+                ON results (method, parameter, value)''')
+
+    def add_results(self, rows: list[tuple[str, str, str, str, str, int, str, float, str]]) \
+            -> None:
+        """Add the results in rows to the database in a single transaction, replacing any
+        existing results with the same identity.  Each row is a tuple of (country, stock, stream,
+        transform, method, parameter, resolution, value, data_hash).
+        """
+        with self._lock, self._get_connection():
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def get_results(self, country: str, stock: str, stream: str, transform: str, method: str,
+                    resolution: str, data_hash: str) -> dict[int, float]:
+        """Return a mapping from each parameter to the value of the result with the given
+        identity, only including the results calculated from data with hash data_hash.
+        """
+        with self._lock:
+            rows = self._get_connection().execute(
+                '''SELECT parameter, value FROM results
+                   WHERE country = ? AND stock = ? AND stream = ? AND transform = ?
+                   AND method = ? AND resolution = ? AND data_hash = ?''',
+                (country, stock, stream, transform, method, resolution, data_hash)).fetchall()
+
+        return {parameter: value for parameter, value in rows}
+
+    def find_peaks(self, method: str, min_value: float, min_parameter: int, max_parameter: int,
+                   data_hashes: set[str]) -> list[tuple[str, str, str, str, str, int, float]]:
+        """Return the (country, stock, stream, transform, resolution, parameter, value) of the
+        largest result of method for each combination, considering only the parameters between
+        min_parameter and max_parameter inclusive, and keeping only the combinations whose largest
+        result is greater than min_value.
+
+        Only the results calculated from data with a hash in data_hashes are considered, so that
+        results calculated from data that has since changed are never returned.
+
+        For example, find_peaks('global', 0.3, 5, 20, data_hashes) finds every combination whose
+        correlation peaks above 0.3 for a shift of between 5 and 20.
+        """
+        if not data_hashes:
+            return []
+
+        placeholders = ', '.join('?' * len(data_hashes))
+
+        with self._lock:
+            # SQLite fills in the bare parameter column from the row that has the MAX(value).
+            return self._get_connection().execute(
+                f'''SELECT country, stock, stream, transform, resolution, parameter, MAX(value)
+                    FROM results
+                    WHERE method = ? AND parameter BETWEEN ? AND ?
+                    AND data_hash IN ({placeholders})
+                    GROUP BY country, stock, stream, transform, resolution
+                    HAVING MAX(value) > ?
+                    ORDER BY country, stock, stream, transform, resolution''',
+                (method, min_parameter, max_parameter, *data_hashes, min_value)).fetchall()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """Return the connection to the database for the current process.  The caller must be
+        holding self._lock.
+        """
+        if os.getpid() != self._pid:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def close(self) -> None:
+        """Close the connection to the database.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['os', 'sqlite3', 'threading'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,206 @@
+"""COVID-19 Economics - Sparse Data Series
+
+This module consists of the SparseSeries class and its helper functions.  A
+SparseSeries is a memory efficient alternative to the zero-filled data
+produced by fill_*_data.  Only the days that actually have a non-zero value are
+stored, which for weekly reporting countries is a small fraction of the time
+range.  Since each stored day costs 12 bytes (instead of 8 bytes for every day
+of a dense series), a series only saves memory when fewer than two thirds of
+its days are non-zero; see is_worth_storing_sparsely.
+
+This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
+"""
+import datetime
+from typing import Union
+
+import numpy as np
+
+
+class SparseSeries:
+    """A series of values over a time range where every day that is not stored is assumed to
+    be 0.
+
+    Instance Attributes:
+        - offsets: The days (since the start of the time range) that have a non-zero value, in
+                   increasing order.
+        - values: The value of each day in offsets.  values[i] is the value of day offsets[i].
+        - length: The number of days in the time range (including the days that are 0).
+
+    Representation Invariants:
+        - self.offsets.dtype == np.int32
+        - len(self.offsets) == len(self.values)
+        - (np.diff(self.offsets) > 0).all()
+        - ((0 <= self.offsets) & (self.offsets < self.length)).all()
+        - (self.values != 0).all()
+
+    >>> series = SparseSeries([1, 3], [1.0, 2.0], 4)
+    >>> series.to_dense().tolist()
+    [0.0, 1.0, 0.0, 2.0]
+
+    A country that only reports weekly takes a fraction of the memory of its dense version:
+
+    >>> weekly = np.array(([0] * 6 + [100]) * 96)
+    >>> sparse_weekly = make_sparse_from_dense(weekly)
+    >>> (sparse_weekly.nbytes(), weekly.nbytes)
+    (1152, 5376)
+    """
+    offsets: np.ndarray
+    values: np.ndarray
+    length: int
+
+    def __init__(self, offsets: Union[list[int], np.ndarray],
+                 values: Union[list[Union[int, float]], np.ndarray], length: int) -> None:
+        """Initialize a new sparse series from already sorted offsets and their values.  The
+        values keep their type, so a series of ints stays a series of ints.
+
+        Preconditions:
+            - len(offsets) == len(values)
+            - all(offsets[i] < offsets[i + 1] for i in range(len(offsets) - 1))
+            - all(0 <= offset < length for offset in offsets)
+            - all(value != 0 for value in values)
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int32)
+        self.values = np.asarray(values)
+        self.length = length
+
+    def __len__(self) -> int:
+        """Return the number of days in the time range of this series.
+
+        >>> len(SparseSeries([1], [5], 10))
+        10
+        """
+        return self.length
+
+    def nbytes(self) -> int:
+        """Return the number of bytes used to store the days of this series.
+
+        >>> SparseSeries([1], [5.0], 10).nbytes()
+        12
+        """
+        return self.offsets.nbytes + self.values.nbytes
+
+    def to_dense(self) -> np.ndarray:
+        """Return a zero-filled array of this series, in the same format as fill_*_data.
+
+        >>> SparseSeries([0, 2], [3, 4], 4).to_dense().tolist()
+        [3, 0, 4, 0]
+        >>> SparseSeries([], [], 2).to_dense().tolist()
+        [0.0, 0.0]
+        """
+        dense = np.zeros(self.length, dtype=self.values.dtype)
+        dense[self.offsets] = self.values
+        return dense
+
+    def abs_average(self) -> float:
+        """Return the average magnitude of the non-zero values of this series.
+
+        This is equivalent to inflated_abs_average on the dense version of this series, but
+        only has to look at the days that are actually stored.
+
+        Preconditions:
+            - len(self.values) > 0
+
+        >>> SparseSeries([0, 5], [-1.0, 3.0], 10).abs_average()
+        2.0
+        """
+        return float(np.abs(self.values).mean())
+
+    def spikes(self, threshold: float) -> list[tuple[int, Union[int, float]]]:
+        """Return the (offset, value) pairs of the days whose magnitude is at least threshold,
+        in increasing order of offset.
+
+        Preconditions:
+            - threshold > 0
+
+        >>> SparseSeries([0, 2, 3], [1, -5, 2], 4).spikes(2)
+        [(2, -5), (3, 2)]
+        """
+        is_spike = np.abs(self.values) >= threshold
+        return list(zip(self.offsets[is_spike].tolist(), self.values[is_spike].tolist()))
+
+
+def make_sparse_series(dates: list[datetime.date],
+                       data: Union[list[Union[int, float]], np.ndarray],
+                       start: datetime.date, end: datetime.date) -> SparseSeries:
+    """Return a sparse series of the given data over the days between start and end inclusive.
+    This is the sparse equivalent of fill_covid_data and fill_stock_data, where the days that are
+    not provided in data (or are 0) are not stored at all.
+
+    Preconditions:
+        - len(data) == len(dates)
+        - start < end
+        - all(start <= d <= end for d in dates)
+
+    >>> series = make_sparse_series([datetime.date(2021, 1, 4), datetime.date(2021, 1, 2)], \
+                                    [2, 1], datetime.date(2021, 1, 1), datetime.date(2021, 1, 4))
+    >>> (series.offsets.tolist(), series.values.tolist(), series.length)
+    ([1, 3], [1, 2], 4)
+    """
+    offsets = np.array([(date - start).days for date in dates], dtype=np.int32)
+    values = np.asarray(data)
+
+    order = np.argsort(offsets, kind='stable')
+    offsets, values = offsets[order], values[order]
+    is_stored = values != 0
+
+    return SparseSeries(offsets[is_stored], values[is_stored], (end - start).days + 1)
+
+
+def make_sparse_from_dense(data: Union[list[Union[int, float]], np.ndarray]) -> SparseSeries:
+    """Return a sparse series of data, which is zero-filled data like that returned from
+    fill_*_data.
+
+    >>> series = make_sparse_from_dense([0, 1, 0, 2])
+    >>> (series.offsets.tolist(), series.values.tolist(), series.length)
+    ([1, 3], [1, 2], 4)
+    """
+    data = np.asarray(data)
+    offsets = np.flatnonzero(data)
+    return SparseSeries(offsets, data[offsets], len(data))
+
+
+def is_worth_storing_sparsely(data: Union[list[Union[int, float]], np.ndarray]) -> bool:
+    """Return whether the sparse version of data, which is zero-filled data like that returned
+    from fill_*_data, would use less memory than data itself.  Only the non-zero days of data are
+    counted, so no sparse series is built to decide.
+
+    >>> is_worth_storing_sparsely([0, 0, 0, 1.0])
+    True
+    >>> is_worth_storing_sparsely(np.array([1.0, 1.0, 0, 1.0]))
+    False
+    """
+    data = np.asarray(data)
+    offset_size = np.dtype(np.int32).itemsize
+    sparse_size = int(np.count_nonzero(data)) * (offset_size + data.itemsize)
+    return sparse_size < data.size * data.itemsize
+
+
+def to_dense(data: Union[list[Union[int, float]], np.ndarray, SparseSeries]) \
+        -> Union[list[Union[int, float]], np.ndarray]:
+    """Return data as zero-filled data, converting it only if it is a SparseSeries.
+
+    >>> to_dense([0, 1])
+    [0, 1]
+    >>> to_dense(SparseSeries([1], [1], 2)).tolist()
+    [0, 1]
+    """
+    if isinstance(data, SparseSeries):
+        return data.to_dense()
+    else:
+        return data
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'extra-imports': ['datetime', 'numpy'],
+        'allowed-io': [],
+        'max-line-length': 100,
+        'disable': ['R1705', 'C0200']
+    })
+
+    import python_ta.contracts
+    python_ta.contracts.check_all_contracts()
+
+    import doctest
+    doctest.testmod()
@@ -7,15 +7,20 @@ cache).
 
 This file is Copyright (C) 2021, Theodore Preduta and Jacob Kolyakov.
 """
+import functools
+from typing import Any, Optional
+
 import dash
 from dash import dcc
 from dash import html
 from dash.dependencies import Input, Output
 import plotly.express as px
 from plotly.graph_objs import Figure  # for type contracts
+import waitress
 
 from data_management import DataManager
-from config import LONG_NAMES, ALL_STOCKS, ALL_COUNTRIES
+from result_cache import ResultCache
+from config import LONG_NAMES, ALL_STOCKS, ALL_COUNTRIES, RESOLUTION_DAYS, RESOLUTION_UNITS
 
 
 class UserInterface:
@@ -42,20 +47,28 @@ class UserInterface:
     #                            itself.  This allows us to skip noticeably slower calculations.
     #     - _local_trend_cache: A mapping from a unique id of a graphed datapoint to the data
     #                           itself.  This allows us to skip noticeably slower calculations.
+    #
+    # Both caches are safe to share between the threads of the server, and merge
+    # concurrent requests for the same data into a single calculation.
     _app: dash.Dash
     _source: DataManager
-    _global_trend_cache: dict[str, list[float]]
-    _local_trend_cache: dict[str, float]
+    _global_trend_cache: ResultCache
+    _local_trend_cache: ResultCache
 
-    def __init__(self, data_source: DataManager) -> None:
-        """Setup the user interface to use data_source to calculate statistics.
+    def __init__(self, data_source: DataManager, caches: Optional[dict[str, Any]] = None) -> None:
+        """Setup the user interface to use data_source to calculate statistics.  If caches is not
+        None, it is the caches that were saved with a snapshot by save_snapshot, and the user
+        interface starts with those results already cached.
 
         Preconditions:
             - data_source is not None
         """
+        if caches is None:
+            caches = {}
+
         self._source = data_source
-        self._global_trend_cache = {}
-        self._local_trend_cache = {}
+        self._global_trend_cache = ResultCache(caches.get('global'))
+        self._local_trend_cache = ResultCache(caches.get('local'))
 
         self._app = dash.Dash(__name__)
 
@@ -94,7 +107,9 @@ class UserInterface:
             Output(component_id='global-graph', component_property='figure'),
             [Input(component_id='global-stream', component_property='value'),
              Input(component_id='global-countries', component_property='value'),
-             Input(component_id='global-stocks', component_property='value')]
+             Input(component_id='global-stocks', component_property='value'),
+             Input(component_id='global-resolution', component_property='value'),
+             Input(component_id='global-transform', component_property='value')]
         )(self._update_global_weekly_trends)
 
         self._app.callback(
@@ -102,76 +117,131 @@ class UserInterface:
             [Input(component_id='local-stream', component_property='value'),
              Input(component_id='local-countries', component_property='value'),
              Input(component_id='local-stocks', component_property='value'),
-             Input(component_id='local-max-days', component_property='value')]
+             Input(component_id='local-max-days', component_property='value'),
+             Input(component_id='local-resolution', component_property='value'),
+             Input(component_id='local-transform', component_property='value')]
         )(self._update_local_weekly_trends)
 
-    def run(self, debug: bool = False) -> None:
+    def run(self, debug: bool = False, mode: str = 'dev', threads: int = 4) -> None:
         """Start the user interface.
+
+        In 'dev' mode, the user interface is served by Dash's development server, which is only
+        meant for development.  In 'waitress' mode, it is served by the waitress production WSGI
+        server, where every request is handled by one of threads threads of a single process,
+        all sharing this user interface's caches and data source.  debug only applies to 'dev'
+        mode.
+
+        The calculations behind a request do not release the GIL for long enough for threads to
+        overlap, since each one is a few short numpy calls (see
+        find_shifted_correlation_coefficients).  Threads only help by serving other requests
+        while one waits on the network, a cache or the results database.
+
+        Preconditions:
+            - mode in {'dev', 'waitress'}
+            - threads >= 1
+        """
+        if mode == 'dev':
+            self._app.run_server(debug=debug, port=8050)
+        else:
+            waitress.serve(self._app.server, host='localhost', port=8050, threads=threads)
+
+    def save_snapshot(self, path: str) -> None:
+        """Save a snapshot of the data source, along with the cached results of this user
+        interface, to path.  See DataManager.save_snapshot.
+        """
+        self._source.save_snapshot(path, {'global': self._global_trend_cache.get_results(),
+                                          'local': self._local_trend_cache.get_results()})
+
+    def reload_source(self, source: str) -> None:
+        """Reload the data file source into the data source, removing only the cached results
+        that depend on it.
+
+        Preconditions:
+            - 'covid-' in source or 'stock-' in source
         """
-        self._app.run_server(debug=debug, port=8050)
+        self.evict(self._source.reload_source(source))
 
-    def _update_global_weekly_trends(self, stream: str,
-                                     countries: list[str], stocks: list[str]) -> Figure:
+    def evict(self, name: str) -> None:
+        """Remove every cached result that involves the country or stock code name, so that it
+        is recalculated the next time it is requested.  The results of every other combination
+        stay cached.
+        """
+        self._global_trend_cache.evict(lambda metric_id: name in metric_id.split('-')[:2])
+        self._local_trend_cache.evict(lambda metric_id: name in metric_id.split('-')[:2])
+
+    def _update_global_weekly_trends(self, stream: str, countries: list[str],
+                                     stocks: list[str], resolution: str = 'daily',
+                                     transform: str = 'diff') -> Figure:
         """Return an updated graph to display given the user wants to view the data from the
-        combinations of countries with stocks with stream stock stream.
+        combinations of countries with stocks with stream stock stream, aggregated to the given
+        resolution, with the stock price changes measured by transform.
 
         Preconditions:
             - stream in {'open', 'close', 'high', 'low'}
             - all(c in ALL_COUNTRIES for c in countries)
             - all(s in ALL_STOCKS for c in stocks)
+            - resolution in RESOLUTION_DAYS
+            - transform in {'diff', 'percent', 'log', 'volatility'}
         """
         combinations = [(c, s) for c in countries for s in stocks]
+        max_shift = 90 // RESOLUTION_DAYS[resolution]
 
         data = {}
 
         for country, stock in combinations:
             label = f'{LONG_NAMES[country]} v. {LONG_NAMES[stock]}'
 
-            metric_id = f'{country}-{stock}-{stream}'
-            if metric_id not in self._global_trend_cache:
-                stats = self._source.get_global_statistics(stream, 90, stock, country)
-                self._global_trend_cache[metric_id] = stats
-
-            data[label] = self._global_trend_cache[metric_id]
+            metric_id = f'{country}-{stock}-{stream}-{resolution}-{transform}'
+            data[label] = self._global_trend_cache.get(
+                metric_id, functools.partial(self._source.get_global_statistics, stream,
+                                             max_shift, stock, country, resolution, transform))
 
         figure = px.line(data)
-        figure.update_xaxes(title_text='Shift (days)')
+        figure.update_xaxes(title_text=f'Shift ({RESOLUTION_UNITS[resolution]})')
         figure.update_yaxes(title_text='Correlation Coefficient')
         return figure
 
     def _update_local_weekly_trends(self, stream: str, countries: list[str], stocks: list[str],
-                                    max_days: int) -> Figure:
+                                    max_days: int, resolution: str = 'daily',
+                                    transform: str = 'diff') -> Figure:
         """Return an updated graph to display given the user wants to view the data from the
         combinations of countries with stock stream stock stream given a maximum reaction time
-        of max_days.
+        of max_days, aggregated to the given resolution, with the stock price changes measured
+        by transform.
+
+        The maximum reaction time is rounded down to a whole number of periods of resolution.
 
         Preconditions:
             - stream in {'open', 'close', 'high', 'low'}
             - all(c in ALL_COUNTRIES for c in countries)
             - all(s in ALL_STOCKS for c in stocks)
             - max_days >= 0
+            - resolution in RESOLUTION_DAYS
+            - transform in {'diff', 'percent', 'log', 'volatility'}
         """
         combinations = [(c, s) for c in countries for s in stocks]
+        max_gap = max_days // RESOLUTION_DAYS[resolution]
 
         data = {'Country/Stock Combination': [], 'Correlation Coefficient': []}
 
         for country, stock in combinations:
-            metric_id = f'{country}-{stock}-{stream}-{max_days}'
-            if metric_id not in self._local_trend_cache:
-                stat = self._source.get_local_statistics(stream, stock, country, max_days)
-                self._local_trend_cache[metric_id] = stat
+            metric_id = f'{country}-{stock}-{stream}-{max_gap}-{resolution}-{transform}'
+            stat = self._local_trend_cache.get(
+                metric_id, functools.partial(self._source.get_local_statistics, stream, stock,
+                                             country, max_gap, resolution, transform))
 
             data['Country/Stock Combination']\
                 .append(f'{LONG_NAMES[country]} v. {LONG_NAMES[stock]}')
-            data['Correlation Coefficient'].append(self._local_trend_cache[metric_id])
+            data['Correlation Coefficient'].append(stat)
 
         return px.bar(data, x='Country/Stock Combination', y='Correlation Coefficient')
 
 
 def make_control_widget(id_prefix: str, extra_controls: list[html.Div]) -> html.Div:
     """Make an instance of a control widget containing the list of possible countries and
-    stocks along with a stock stream selector, all with id id_prefix-<widget>.  If extra_controls
-    is not empty, the the contents of extra_controls will be added before the stock stream widget.
+    stocks along with a stock stream, a price change and a resolution selector, all with id
+    id_prefix-<widget>.  If extra_controls is not empty, the the contents of extra_controls will
+    be added before the stock stream widget.
 
     Preconditions:
         - id_prefix != ''
@@ -188,6 +258,25 @@ def make_control_widget(id_prefix: str, extra_controls: list[html.Div]) -> html.
                          {'label': 'Close', 'value': 'close'}],
                 value='open',
                 clearable=False
+            ),
+            html.H4('Price Change'),
+            dcc.Dropdown(
+                id=f'{id_prefix}-transform',
+                options=[{'label': 'Absolute', 'value': 'diff'},
+                         {'label': 'Percent', 'value': 'percent'},
+                         {'label': 'Logarithmic', 'value': 'log'},
+                         {'label': 'Volatility Normalized', 'value': 'volatility'}],
+                value='diff',
+                clearable=False
+            ),
+            html.H4('Resolution'),
+            dcc.Dropdown(
+                id=f'{id_prefix}-resolution',
+                options=[{'label': 'Daily', 'value': 'daily'},
+                         {'label': 'Weekly', 'value': 'weekly'},
+                         {'label': 'Monthly', 'value': 'monthly'}],
+                value='daily',
+                clearable=False
             )
         ]),
         html.Div(className='control', children=[
@@ -214,8 +303,9 @@ def make_control_widget(id_prefix: str, extra_controls: list[html.Div]) -> html.
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['dash', 'dash.dependencies', 'plotly.express', 'plotly.graph_objs',
-                          'data_management', 'config'],
+        'extra-imports': ['functools', 'dash', 'dash.dependencies', 'plotly.express',
+                          'plotly.graph_objs', 'waitress', 'data_management',
+                          'result_cache', 'config'],
         'allowed-io': [],
         'max-line-length': 100,
         'disable': ['R1705', 'C0200']